@@ -1,14 +1,18 @@
 from __future__ import annotations
 
-import io
+import csv
 import uuid
-from typing import Any, Dict
+from collections import OrderedDict
+from typing import Any, Dict, List
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from fastapi import APIRouter, File, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 
-from app.core.profiling import preview_payload
+from app.core.config import MAX_STATES
 from app.core.storage import DatasetStore
 from app.graph.builder import build_graph
 from app.graph.state import AgentState
@@ -19,8 +23,16 @@ router = APIRouter()
 store = DatasetStore()
 graph = build_graph()
 
-# Persist AgentState per dataset_id across chat turns (MVP memory store)
-STATE_STORE: Dict[str, AgentState] = {}
+# Persist AgentState per dataset_id across chat turns (MVP memory store).
+# Bounded LRU so a long-lived server does not grow one entry per dataset ever seen.
+STATE_STORE: "OrderedDict[str, AgentState]" = OrderedDict()
+
+
+def _remember_state(dataset_id: str, state: AgentState) -> None:
+    STATE_STORE[dataset_id] = state
+    STATE_STORE.move_to_end(dataset_id)
+    while len(STATE_STORE) > MAX_STATES:
+        STATE_STORE.popitem(last=False)
 
 
 class ChatRequest(BaseModel):
@@ -29,24 +41,110 @@ class ChatRequest(BaseModel):
     show_code: bool = Field(False, description="If true, include generated code when available")
 
 
+def _header_names(fileobj: Any, encoding: str) -> List[str]:
+    """
+    Column names as pd.read_csv would give them: blank cells become "Unnamed: <i>" and
+    repeated names are suffixed ("sales", "sales.1"), so every column keeps a unique key.
+    """
+    fileobj.seek(0)
+    codec = "utf-8-sig" if encoding == "utf8" else encoding
+    # Lines are pulled lazily: csv only reads past the first one for a quoted multi-line name
+    lines = (line.decode(codec, errors="replace") for line in iter(fileobj.readline, b""))
+    raw = next(csv.reader(lines), [])
+
+    names = [name if name else f"Unnamed: {i}" for i, name in enumerate(raw)]
+    counts: Dict[str, int] = {}
+    for i, name in enumerate(names):
+        n = counts.get(name, 0)
+        while n > 0:
+            counts[name] = n + 1
+            name = f"{name}.{n}"
+            n = counts.get(name, 0)
+        names[i] = name
+        counts[name] = n + 1
+    return names
+
+
+def _read_csv(fileobj: Any, names: List[str], dict_encode: bool, encoding: str) -> pa.Table:
+    fileobj.seek(0)
+    return pacsv.read_csv(
+        fileobj,
+        read_options=pacsv.ReadOptions(
+            use_threads=True,
+            block_size=4 << 20,
+            encoding=encoding,
+            column_names=names,
+            skip_rows=1,
+        ),
+        convert_options=pacsv.ConvertOptions(
+            # Low-cardinality string columns become dictionary<int32, string> at parse time
+            auto_dict_encode=dict_encode,
+            auto_dict_max_cardinality=256,
+            # Match pandas: empty string cells are missing values, not ""
+            strings_can_be_null=True,
+        ),
+    )
+
+
+def _parse_csv(fileobj: Any, encoding: str = "utf8") -> pa.Table:
+    names = _header_names(fileobj, encoding)
+    try:
+        try:
+            return _read_csv(fileobj, names, dict_encode=True, encoding=encoding)
+        except pa.ArrowIndexError:
+            # Dictionary cardinality exceeded while merging blocks: keep those columns as plain strings
+            return _read_csv(fileobj, names, dict_encode=False, encoding=encoding)
+    except pa.ArrowInvalid:
+        # Ragged rows (fewer fields than the header) and other inputs pandas tolerates:
+        # parse with pandas, which pads short rows with NaN, and convert once.
+        fileobj.seek(0)
+        df = pd.read_csv(fileobj, encoding=encoding, low_memory=False)
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _has_binary_columns(schema: pa.Schema) -> bool:
+    for f in schema:
+        t = f.type.value_type if pa.types.is_dictionary(f.type) else f.type
+        if pa.types.is_binary(t) or pa.types.is_large_binary(t):
+            return True
+    return False
+
+
+def _ingest_csv(dataset_id: str, fileobj: Any) -> None:
+    """
+    Parse the CSV with the multithreaded Arrow reader and persist it in the dataset store.
+    The whole-file reader (not the streaming one) infers each column's type over every block,
+    so an int column that turns float later is promoted to double as pandas would, not rejected.
+    Column names and ragged rows follow pd.read_csv, so uploads it accepted still work.
+    """
+    try:
+        table = _parse_csv(fileobj)
+    except UnicodeDecodeError:
+        # Only the pandas fallback decodes strictly; the latin-1 retry below covers it too
+        table = _parse_csv(fileobj, encoding="latin-1")
+    if _has_binary_columns(table.schema):
+        # Text that is not valid UTF-8 (typically an Excel cp1252/latin-1 export) is left as raw
+        # bytes, which JSON responses cannot carry: decode the file as latin-1 instead.
+        table = _parse_csv(fileobj, encoding="latin-1")
+    store.put(dataset_id, table)
+
+
 @router.post("/upload")
 async def upload_file(file: UploadFile = File(...)) -> Dict[str, Any]:
     """
-    Upload a CSV file, store it server-side (in-memory MVP), and return dataset_id and head preview.
+    Upload a CSV file, store it server-side (Feather on disk), and return dataset_id and head preview.
     """
-    content = await file.read()
     dataset_id = str(uuid.uuid4())
 
     try:
-        df = pd.read_csv(io.BytesIO(content))
+        # Blocking file IO + parse: keep it off the event loop
+        await run_in_threadpool(_ingest_csv, dataset_id, file.file)
     except Exception as e:
         return {
             "ok": False,
             "error": f"Failed to read CSV: {type(e).__name__}: {e}",
         }
 
-    store.put(dataset_id, df)
-
     # New dataset => new conversation state
     STATE_STORE.pop(dataset_id, None)
 
@@ -54,7 +152,7 @@ async def upload_file(file: UploadFile = File(...)) -> Dict[str, Any]:
         "ok": True,
         "dataset_id": dataset_id,
         "filename": file.filename,
-        "preview": preview_payload(df),
+        "preview": store.get_preview(dataset_id),
     }
 
 
@@ -62,27 +160,39 @@ async def upload_file(file: UploadFile = File(...)) -> Dict[str, Any]:
 async def chat(req: ChatRequest) -> Dict[str, Any]:
     """
     Main chat endpoint. Uses LangGraph to progress through:
-    preview -> plan -> infer columns -> confirm/modify -> codegen -> exec -> repair on error -> results
+    preview -> plan + infer columns -> confirm/modify -> codegen -> exec -> repair on error -> results
 
     IMPORTANT (MVP):
     - Persists AgentState per dataset_id so "confirm" does not re-infer a new config and override user changes.
     """
-    df = store.get(req.dataset_id)
-    if df is None:
+    # The exec worker memory-maps the dataset's Feather file itself, so no pandas frame is built
+    # here per turn; one is only materialized as a fallback when there is no file to hand over.
+    dataset_path = store.get_path(req.dataset_id)
+    df = store.get_pandas(req.dataset_id) if dataset_path is None else None
+    if dataset_path is None and df is None:
         return {"ok": False, "error": "Invalid dataset_id. Upload first via /upload."}
 
+    if not store.has_preview(req.dataset_id):
+        # Evicted or from a previous run: re-profiling scans the whole table, off the event loop
+        await run_in_threadpool(store.get_preview, req.dataset_id)
+    df_preview = store.get_preview(req.dataset_id)
+    df_preview_str = store.get_preview_str(req.dataset_id)
+
     prev_state = STATE_STORE.get(req.dataset_id)
 
     if prev_state:
-        # Rehydrate existing state for this dataset_id
-        state: AgentState = dict(prev_state)  # shallow copy is fine
-        state["df"] = df
-        state["df_preview"] = preview_payload(df)  # refresh (optional but safe)
+        STATE_STORE.move_to_end(req.dataset_id)
+        # Rehydrate existing state for this dataset_id (reused in place; no per-turn copy)
+        state: AgentState = prev_state
+        state["df_preview"] = df_preview  # cached at upload
+        state["df_preview_str"] = df_preview_str
+        state["dataset_path"] = str(dataset_path) if dataset_path else ""
         state["user_message"] = req.message
         state["show_code"] = req.show_code
 
         # Reset execution envelope for this turn
         state["attempt"] = 0
+        state["prior_code_hashes"] = []
         state["exec_output"] = None
         state["exec_error"] = None
         state["traceback"] = None
@@ -91,8 +201,9 @@ async def chat(req: ChatRequest) -> Dict[str, Any]:
         state = AgentState(
             dataset_id=req.dataset_id,
             user_message=req.message,
-            df=df,
-            df_preview=preview_payload(df),
+            df_preview=df_preview,
+            df_preview_str=df_preview_str,
+            dataset_path=str(dataset_path) if dataset_path else "",
             attempt=0,
             max_attempts=2,
             show_code=req.show_code,
@@ -101,13 +212,20 @@ async def chat(req: ChatRequest) -> Dict[str, Any]:
             plan_last_updated="",
             plan_text="",
         )
+    if df is not None:
+        state["df"] = df
 
-    final_state = await graph.ainvoke(state)
-
-    # Persist for next turn (store without df to reduce memory usage)
-    to_store: AgentState = dict(final_state)
-    to_store.pop("df", None)
-    STATE_STORE[req.dataset_id] = to_store
+    try:
+        final_state = await graph.ainvoke(state)
+    finally:
+        # `state` may be the persisted entry itself: never leave the per-turn frame pinned in
+        # STATE_STORE, even when the graph raises (e.g. an OpenAI error).
+        state.pop("df", None)
+
+    # Persist for next turn (store without df to reduce memory usage).
+    # df is a fresh per-turn frame from the store, so dropping it in place is safe.
+    final_state.pop("df", None)
+    _remember_state(req.dataset_id, final_state)
 
     response: Dict[str, Any] = {
         "ok": True,
@@ -8,6 +8,27 @@ load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Cosine similarity above which a previously seen dataset preview reuses its plan/config
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.93"))
+# Same, for reusing a Q&A answer to a near-identical question about the same context
+QA_SEMANTIC_CACHE_THRESHOLD = float(os.getenv("QA_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+
+# Uploaded datasets are spilled here as Feather (Arrow IPC) files and memory-mapped on access
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", ".dataset_cache")
+DATASET_CACHE_MAX_TABLES = int(os.getenv("DATASET_CACHE_MAX_TABLES", "32"))
+# Preview/profile payloads are small and costly to recompute: bounded separately from open tables
+DATASET_CACHE_MAX_PREVIEWS = int(os.getenv("DATASET_CACHE_MAX_PREVIEWS", "4096"))
+
+# Generated Prophet code keyed by normalized confirmed_config (survives restarts)
+CODEGEN_CACHE_DIR = os.getenv("CODEGEN_CACHE_DIR", ".codegen_cache")
+
+# Per-dataset conversation states kept in memory (least recently used are dropped)
+MAX_STATES = int(os.getenv("MAX_STATES", "1024"))
+
+# Worker processes that run generated forecasting code (Prophet fits are CPU-bound)
+EXEC_WORKERS = int(os.getenv("EXEC_WORKERS", str(os.cpu_count() or 1)))
 
 
 def require_openai_key() -> str:
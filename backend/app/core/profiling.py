@@ -1,37 +1,130 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Union
+
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Sample values only need k examples: scan a small prefix and widen it geometrically only while
+# fewer than k distinct non-null values have been seen. unique() keeps first-occurrence order, so
+# the result equals taking the first k uniques of the whole column.
+_SAMPLE_WINDOW_START = 64
+_SAMPLE_WINDOW_GROWTH = 8
 
 
 def _sample_values(series: pd.Series, k: int = 3) -> List[Any]:
-    vals = series.dropna().unique().tolist()
-    return vals[:k]
+    n = len(series)
+    window = _SAMPLE_WINDOW_START
+    while True:
+        vals = series.iloc[:window].dropna().unique()
+        if len(vals) >= k or window >= n:
+            return vals[:k].tolist()
+        window *= _SAMPLE_WINDOW_GROWTH
+
+
+def _sample_values_arrow(arr: pa.ChunkedArray, k: int = 3) -> List[Any]:
+    n = len(arr)
+    window = _SAMPLE_WINDOW_START
+    while True:
+        # slice() is zero-copy and only touches the chunks that overlap the window
+        vals = pc.drop_null(pc.unique(arr.slice(0, window)))
+        if len(vals) >= k or window >= n:
+            return vals.slice(0, k).to_pylist()
+        window *= _SAMPLE_WINDOW_GROWTH
 
 
 def profile_dataframe(df: pd.DataFrame) -> Dict[str, Any]:
     out: Dict[str, Any] = {"n_rows": int(df.shape[0]), "n_cols": int(df.shape[1]), "columns": {}}
     n = max(int(df.shape[0]), 1)
 
-    for col in df.columns:
-        s = df[col]
-        missing = int(s.isna().sum())
-        dtype = str(s.dtype)
-        unique = int(s.nunique(dropna=True))
+    # One whole-frame pass per statistic instead of separate scans per column
+    missing_counts = df.isna().sum()
+    unique_counts = df.nunique(dropna=True)
+
+    for i, (col, dtype, missing, unique) in enumerate(
+        zip(df.columns, df.dtypes, missing_counts.values, unique_counts.values)
+    ):
+        missing = int(missing)
         out["columns"][col] = {
-            "dtype": dtype,
+            "dtype": str(dtype),
+            "missing_count": missing,
+            "missing_pct": round((missing / n) * 100.0, 2),
+            "unique_count": int(unique),
+            "sample_values": _sample_values(df.iloc[:, i]),
+        }
+    return out
+
+
+def profile_arrow(table: pa.Table) -> Dict[str, Any]:
+    """
+    Same shape as profile_dataframe, computed with Arrow compute kernels directly on the
+    ChunkedArrays (vectorized hash kernels; no pandas conversion, no Python-object hashing).
+    """
+    out: Dict[str, Any] = {"n_rows": int(table.num_rows), "n_cols": int(table.num_columns), "columns": {}}
+    n = max(int(table.num_rows), 1)
+
+    for col, arr in zip(table.column_names, table.columns):
+        if pa.types.is_null(arr.type):
+            missing, unique = len(arr), 0
+        elif pa.types.is_dictionary(arr.type):
+            # Dictionary-encoded at parse time; the store unifies dictionaries across chunks and
+            # nulls live in the indices, so the distinct count is just the dictionary size.
+            missing = int(arr.null_count)
+            unique = len(arr.chunk(0).dictionary) if arr.num_chunks else 0
+        else:
+            if pa.types.is_floating(arr.type):
+                # Match pandas isna(): NaN counts as missing too
+                missing = int(pc.sum(pc.is_null(arr, nan_is_null=True)).as_py() or 0)
+            else:
+                missing = int(arr.null_count)
+            unique = int(pc.count_distinct(arr, mode="only_valid").as_py())
+
+        # Report a dictionary column by its value type: that is the dtype generated code sees
+        dtype = arr.type.value_type if pa.types.is_dictionary(arr.type) else arr.type
+        out["columns"][col] = {
+            "dtype": str(dtype),
             "missing_count": missing,
             "missing_pct": round((missing / n) * 100.0, 2),
             "unique_count": unique,
-            "sample_values": _sample_values(s),
+            "sample_values": _sample_values_arrow(arr),
         }
     return out
 
 
-def preview_payload(df: pd.DataFrame) -> Dict[str, Any]:
-    head = df.head(5).to_dict(orient="records")
+def preview_payload(data: Union[pd.DataFrame, pa.Table]) -> Dict[str, Any]:
+    if isinstance(data, pa.Table):
+        return {
+            # Zero-copy slice + one native walk; no intermediate DataFrame
+            "head": data.slice(0, 5).to_pylist(),
+            "profile": profile_arrow(data),
+            "columns": list(data.column_names),
+        }
+
+    head = data.head(5).to_dict(orient="records")
     return {
         "head": head,
-        "profile": profile_dataframe(df),
-        "columns": list(df.columns),
+        "profile": profile_dataframe(data),
+        "columns": list(data.columns),
     }
+
+
+def format_preview_for_llm(preview: Dict[str, Any]) -> str:
+    """
+    Render a preview payload into the prompt block shared by the plan/inference nodes.
+    The payload is invariant per dataset, so callers cache the result next to it.
+    """
+    # Compact JSON: dates and timestamps render as ISO strings, not datetime.date(...) reprs
+    def dump(obj: Any) -> str:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    return f"""DATASET PREVIEW (top 5 rows):
+{dump(preview["head"])}
+
+COLUMN PROFILE:
+{dump(preview["profile"])}
+
+COLUMNS:
+{dump(preview["columns"])}
+"""
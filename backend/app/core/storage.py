@@ -1,21 +1,151 @@
 from __future__ import annotations
 
+import os
+import uuid
+from collections import OrderedDict
 from dataclasses import dataclass, field
-from typing import Dict, Optional
+from pathlib import Path
+from typing import Any, Dict, Optional
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from app.core.config import DATASET_CACHE_DIR, DATASET_CACHE_MAX_PREVIEWS, DATASET_CACHE_MAX_TABLES
+from app.core.profiling import format_preview_for_llm, preview_payload
+
+
+def arrow_to_pandas(table: pa.Table) -> pd.DataFrame:
+    """
+    DataFrame for generated code. Dictionary-encoded columns are decoded to their value type
+    first: as pandas Categoricals they would reject fillna/astype calls that plain columns accept.
+    """
+    if any(pa.types.is_dictionary(f.type) for f in table.schema):
+        schema = pa.schema(
+            [f.with_type(f.type.value_type) if pa.types.is_dictionary(f.type) else f for f in table.schema],
+            metadata=table.schema.metadata,
+        )
+        table = table.cast(schema)
+    # The table may stay in the store, so its buffers must not be self-destructed here.
+    return table.to_pandas(split_blocks=True, self_destruct=False)
 
 
 @dataclass
 class DatasetStore:
     """
-    MVP in-memory dataset store.
-    For production: store in disk (parquet) or DB keyed by dataset_id + user/session.
+    MVP dataset store backed by Feather (Arrow IPC) files on disk.
+
+    Each upload is written once to `cache_dir/<dataset_id>.feather` and memory-mapped on access,
+    so resident memory does not grow with the number of datasets and files survive restarts.
+    A small LRU of open (memory-mapped) tables avoids re-opening hot datasets every turn.
+    The preview/profile payload (and its LLM prompt rendering) is computed once per dataset
+    and kept in its own, larger LRU: evicting a memory-mapped table does not force a re-profile.
     """
-    _data: Dict[str, pd.DataFrame] = field(default_factory=dict)
+    cache_dir: Path = field(default_factory=lambda: Path(DATASET_CACHE_DIR))
+    max_open_tables: int = DATASET_CACHE_MAX_TABLES
+    max_previews: int = DATASET_CACHE_MAX_PREVIEWS
+    _data: "OrderedDict[str, pa.Table]" = field(default_factory=OrderedDict)
+    _preview: "OrderedDict[str, Dict[str, Any]]" = field(default_factory=OrderedDict)
+    _preview_str: Dict[str, str] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, dataset_id: str) -> Optional[Path]:
+        # dataset_id comes from the client; only accept the UUIDs issued by /upload
+        try:
+            uuid.UUID(dataset_id)
+        except ValueError:
+            return None
+        return self.cache_dir / f"{dataset_id}.feather"
+
+    def _remember(self, dataset_id: str, table: pa.Table) -> None:
+        self._data[dataset_id] = table
+        self._data.move_to_end(dataset_id)
+        while len(self._data) > self.max_open_tables:
+            self._data.popitem(last=False)
+
+    def _build_preview(self, dataset_id: str, table: pa.Table) -> Dict[str, Any]:
+        preview = preview_payload(table)
+        self._preview[dataset_id] = preview
+        self._preview_str[dataset_id] = format_preview_for_llm(preview)
+        while len(self._preview) > self.max_previews:
+            evicted, _ = self._preview.popitem(last=False)
+            self._preview_str.pop(evicted, None)
+        return preview
+
+    def put(self, dataset_id: str, table: pa.Table) -> None:
+        """
+        Persist a parsed table into the dataset's Feather file and open it memory-mapped.
+        """
+        path = self._path(dataset_id)
+        if path is None:
+            raise ValueError(f"Invalid dataset_id: {dataset_id!r}")
+
+        # IPC files allow a single dictionary per field, but the CSV reader builds one per block
+        if any(pa.types.is_dictionary(f.type) for f in table.schema):
+            table = table.unify_dictionaries()
+
+        # Uncompressed Feather V2 (= Arrow IPC file) so reads are a true zero-copy memory map;
+        # write-then-rename keeps concurrent readers from seeing a partial file.
+        tmp = path.with_suffix(".feather.tmp")
+        try:
+            with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        os.replace(tmp, path)
+
+        table = feather.read_table(path, memory_map=True)
+        self._remember(dataset_id, table)
+        self._build_preview(dataset_id, table)
+
+    def get_path(self, dataset_id: str) -> Optional[Path]:
+        """
+        Absolute location of the dataset's Feather file, for readers in other processes.
+        """
+        path = self._path(dataset_id)
+        if path is None or not path.exists():
+            return None
+        return path.resolve()
+
+    def get_arrow(self, dataset_id: str) -> Optional[pa.Table]:
+        table = self._data.get(dataset_id)
+        if table is not None:
+            self._data.move_to_end(dataset_id)
+            return table
+
+        path = self._path(dataset_id)
+        if path is None or not path.exists():
+            return None
+
+        table = feather.read_table(path, memory_map=True)
+        self._remember(dataset_id, table)
+        return table
+
+    def has_preview(self, dataset_id: str) -> bool:
+        return dataset_id in self._preview and dataset_id in self._preview_str
+
+    def get_preview(self, dataset_id: str) -> Optional[Dict[str, Any]]:
+        preview = self._preview.get(dataset_id)
+        if preview is not None:
+            self._preview.move_to_end(dataset_id)
+            return preview
+
+        # Evicted or loaded from a previous run: rebuild once from the memory-mapped file
+        table = self.get_arrow(dataset_id)
+        if table is None:
+            return None
+        return self._build_preview(dataset_id, table)
 
-    def put(self, dataset_id: str, df: pd.DataFrame) -> None:
-        self._data[dataset_id] = df
+    def get_preview_str(self, dataset_id: str) -> Optional[str]:
+        if dataset_id not in self._preview_str:
+            self.get_preview(dataset_id)
+        return self._preview_str.get(dataset_id)
 
-    def get(self, dataset_id: str) -> Optional[pd.DataFrame]:
-        return self._data.get(dataset_id)
+    def get_pandas(self, dataset_id: str) -> Optional[pd.DataFrame]:
+        table = self.get_arrow(dataset_id)
+        if table is None:
+            return None
+        return arrow_to_pandas(table)
@@ -6,12 +6,11 @@ from app.graph.qa import is_probably_qa
 from app.graph.state import AgentState
 from app.graph.nodes import (
     supervisor_preview_node,
-    plan_node,
-    column_inference_node,
+    plan_and_infer_node,
     user_confirmation_node,
     codegen_node,
     exec_node,
-    traceback_node,
+    code_digest,
     repair_codegen_node,
     results_node,
     qa_node,
@@ -30,7 +29,7 @@ def _route_start(state: AgentState) -> str:
       (Typical when user sends another message after a successful confirm, or state is persisted.)
     - If we already have a proposed_config, go directly to confirm to interpret user_message
       ("confirm" or "modify ..."), without re-inferring columns.
-    - Otherwise this is the first turn for the dataset_id: run preview -> plan -> infer.
+    - Otherwise this is the first turn for the dataset_id: run preview -> plan+infer.
     """
     if is_probably_qa(state.get("user_message", "")):
         return "qa"    
@@ -56,11 +55,22 @@ def _route_after_exec(state: AgentState) -> str:
         attempt = int(state.get("attempt", 0) or 0)
         max_attempts = int(state.get("max_attempts", 2) or 2)
         if attempt < max_attempts:
-            return "traceback"
+            return "repair"
         return "results"
     return "results"
 
 
+def _route_after_repair(state: AgentState) -> str:
+    """
+    Skip the re-run when repair produced code that already failed this turn
+    (repair_codegen_node leaves that code in place and exhausts the attempts).
+    """
+    code = state.get("generated_code") or ""
+    if code_digest(code) in (state.get("prior_code_hashes") or []):
+        return "results"
+    return "exec"
+
+
 def build_graph():
     g = StateGraph(AgentState)
 
@@ -72,12 +82,10 @@ def build_graph():
     g.add_node("start", start_node)
 
     g.add_node("preview", supervisor_preview_node)
-    g.add_node("plan", plan_node)
-    g.add_node("infer_columns", column_inference_node)
+    g.add_node("plan_and_infer", plan_and_infer_node)
     g.add_node("confirm", user_confirmation_node)
     g.add_node("codegen", codegen_node)
     g.add_node("exec", exec_node)
-    g.add_node("traceback", traceback_node)
     g.add_node("repair", repair_codegen_node)
     g.add_node("results", results_node)
     g.add_node("qa", qa_node)
@@ -97,10 +105,9 @@ def build_graph():
         },
     )
 
-    # First-turn flow
-    g.add_edge("preview", "plan")
-    g.add_edge("plan", "infer_columns")
-    g.add_edge("infer_columns", "confirm")
+    # First-turn flow (plan and column inference run concurrently inside one node)
+    g.add_edge("preview", "plan_and_infer")
+    g.add_edge("plan_and_infer", "confirm")
 
     # Confirm flow
     g.add_conditional_edges(
@@ -119,13 +126,19 @@ def build_graph():
         "exec",
         _route_after_exec,
         {
-            "traceback": "traceback",
+            "repair": "repair",
             "results": "results",
         },
     )
 
-    g.add_edge("traceback", "repair")
-    g.add_edge("repair", "exec")
+    g.add_conditional_edges(
+        "repair",
+        _route_after_repair,
+        {
+            "exec": "exec",
+            "results": "results",
+        },
+    )
     g.add_edge("results", END)
     g.add_edge("qa", END)
 
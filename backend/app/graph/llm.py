@@ -1,54 +1,114 @@
 from __future__ import annotations
 
+import functools
+import hashlib
+import re
 from typing import Any, Dict, Optional
 
-from openai import OpenAI
+import numpy as np
+import orjson
+from openai import AsyncOpenAI, BadRequestError
+from openai.lib._pydantic import to_strict_json_schema
+from pydantic import BaseModel
 
-from app.core.config import OPENAI_MODEL, require_openai_key
+from app.core.config import OPENAI_EMBEDDING_MODEL, OPENAI_MODEL, require_openai_key
 
+# Embedding inputs are truncated to stay well inside the embedding model's token limit
+_EMBED_MAX_CHARS = 12000
 
-def _client() -> OpenAI:
-    api_key = require_openai_key()
-    return OpenAI(api_key=api_key)
+# Leading ```json / ```python fence and trailing ``` fence, stripped in one pass
+_FENCE_RE = re.compile(r"\A\s*```(?:json|python)?[ \t]*\n?|\n?```\s*\Z", re.IGNORECASE)
 
 
-async def chat_json(system: str, user: str) -> Dict[str, Any]:
+@functools.lru_cache(maxsize=1)
+def _client() -> AsyncOpenAI:
+    # One client per process: the SDK's pooled httpx client keeps connections alive across calls.
+    # The key is validated on first use (not at import) so the app still starts for health checks.
+    return AsyncOpenAI(api_key=require_openai_key(), max_retries=2, timeout=60.0)
+
+
+@functools.lru_cache(maxsize=32)
+def _prompt_cache_key(system: str) -> str:
+    return "sys-" + hashlib.blake2b(system.encode("utf-8"), digest_size=8).hexdigest()
+
+
+async def _complete(
+    system: str, user: str, temperature: float, response_format: Optional[Dict[str, Any]] = None
+) -> str:
     """
-    Returns parsed JSON from the model. Assumes the prompt requests strict JSON.
+    `system` is the stable prefix (a constant from prompts.py) and `user` the volatile suffix
+    (preview, config, failing code...). Keeping that order lets the provider's automatic prefix
+    cache reuse the prefill; prompt_cache_key routes calls sharing a system prompt together.
     """
     client = _client()
-    resp = client.chat.completions.create(
+    extra: Dict[str, Any] = {"response_format": response_format} if response_format else {}
+    resp = await client.chat.completions.create(
         model=OPENAI_MODEL,
         messages=[
             {"role": "system", "content": system},
             {"role": "user", "content": user},
         ],
-        temperature=0.2,
+        temperature=temperature,
+        prompt_cache_key=_prompt_cache_key(system),
+        **extra,
     )
-    content = resp.choices[0].message.content or "{}"
+    return resp.choices[0].message.content or ""
+
+
+async def chat_json(system: str, user: str) -> Dict[str, Any]:
+    """
+    Returns parsed JSON from the model. Assumes the prompt requests strict JSON.
+    """
+    content = await _complete(system, user, temperature=0.2) or "{}"
 
     # Very small guard: strip code fences if the model adds them
-    content = content.strip()
-    if content.startswith("```"):
-        content = content.strip("`")
-        # crude: remove language token if present
-        lines = content.splitlines()
-        if lines and lines[0].strip().lower() in ("json", "python"):
-            lines = lines[1:]
-        content = "\n".join(lines).strip()
+    content = _FENCE_RE.sub("", content).strip()
+    return orjson.loads(content)
+
 
-    import json
-    return json.loads(content)
+def strict_json_schema(model: type[BaseModel]) -> Dict[str, Any]:
+    """
+    JSON schema of `model` in the form strict structured outputs accept
+    (every property required, no additional properties).
+    """
+    return to_strict_json_schema(model)
+
+
+async def chat_structured(system: str, user: str, name: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Like chat_json, but the output is constrained to `schema` (from strict_json_schema) by the
+    provider's strict structured-output mode, so no fence stripping or JSON repair is needed.
+    A model that rejects json_schema gets the prompt-driven chat_json call instead.
+    """
+    response_format = {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+    try:
+        content = await _complete(system, user, temperature=0.2, response_format=response_format)
+    except BadRequestError:
+        return await chat_json(system, user)
+    return orjson.loads(content or "{}")
 
 
 async def chat_text(system: str, user: str) -> str:
+    return (await _complete(system, user, temperature=0.3)).strip()
+
+
+async def embed(text: str) -> np.ndarray:
+    """
+    Returns an L2-normalized float32 embedding, so inner product == cosine similarity.
+    """
     client = _client()
-    resp = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": user},
-        ],
-        temperature=0.3,
-    )
-    return (resp.choices[0].message.content or "").strip()
+    resp = await client.embeddings.create(model=OPENAI_EMBEDDING_MODEL, input=text[:_EMBED_MAX_CHARS])
+    vec = np.asarray(resp.data[0].embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+
+async def try_embed(text: str) -> Optional[np.ndarray]:
+    """
+    embed() for callers that only use the vector for an optional cache lookup: any failure
+    (rate limit, model not enabled for the key...) returns None so the caller skips the cache.
+    """
+    try:
+        return await embed(text)
+    except Exception:
+        return None
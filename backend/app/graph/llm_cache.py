@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import copy
+import hashlib
+from typing import Any, Dict, Optional
+
+import orjson
+from cachetools import TTLCache
+
+from app.graph.llm import chat_json, chat_structured, chat_text
+
+# Exact-match response cache in front of chat_text/chat_json. Previews, confirmed configs and
+# failing-code tracebacks recur across turns, re-runs and repair retries; a hit skips a full
+# LLM round trip. In-process only: each worker keeps its own cache.
+_CACHE: TTLCache = TTLCache(maxsize=2048, ttl=3600)
+
+CACHE_STATS: Dict[str, int] = {"hits": 0, "misses": 0}
+
+
+def _cache_key(kind: str, system: str, user: str) -> str:
+    payload = orjson.dumps({"kind": kind, "sys": system, "user": user}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _lookup(key: str) -> Any:
+    value = _CACHE.get(key)
+    CACHE_STATS["hits" if value is not None else "misses"] += 1
+    return value
+
+
+async def cached_chat_text(system: str, user: str, key_src: Optional[str] = None) -> str:
+    """
+    key_src, when given, replaces `user` in the cache key: a canonical form of the input that
+    leaves out parts which do not change the answer.
+    """
+    key = _cache_key("text", system, user if key_src is None else key_src)
+    cached = _lookup(key)
+    if cached is not None:
+        return cached
+
+    text = await chat_text(system, user)
+    _CACHE[key] = text
+    return text
+
+
+def peek_chat_json(system: str, user: str, key_src: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    The cached_chat_json entry for these inputs if there is one; never calls the model.
+    """
+    cached = _CACHE.get(_cache_key("json", system, user if key_src is None else key_src))
+    return copy.deepcopy(cached) if cached is not None else None
+
+
+async def cached_chat_json(system: str, user: str, key_src: Optional[str] = None) -> Dict[str, Any]:
+    key = _cache_key("json", system, user if key_src is None else key_src)
+    cached = _lookup(key)
+    if cached is not None:
+        # Callers mutate the returned dict, so never hand out the cached object itself
+        return copy.deepcopy(cached)
+
+    parsed = await chat_json(system, user)
+    _CACHE[key] = copy.deepcopy(parsed)
+    return parsed
+
+
+async def cached_chat_structured(system: str, user: str, name: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    key = _cache_key(f"structured:{name}", system, user)
+    cached = _lookup(key)
+    if cached is not None:
+        return copy.deepcopy(cached)
+
+    parsed = await chat_structured(system, user, name, schema)
+    _CACHE[key] = copy.deepcopy(parsed)
+    return parsed
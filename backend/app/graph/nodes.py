@@ -1,37 +1,81 @@
 from __future__ import annotations
 
+import asyncio
+import difflib
+import functools
+import hashlib
+import multiprocessing
 import traceback as tb
-from typing import Any, Dict, List
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from statistics import NormalDist
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Literal, Tuple, Union
 from app.graph.qa import answer_forecast_qa
 
 import numpy as np
+import orjson
 import pandas as pd
+import pyarrow.feather as feather
 import re
-from prophet import Prophet
+from diskcache import Cache
 
-from app.core.profiling import preview_payload
-from app.graph.llm import chat_json, chat_text
+from app.core.config import CODEGEN_CACHE_DIR, EXEC_WORKERS
+from app.core.profiling import format_preview_for_llm, preview_payload
+from app.core.storage import arrow_to_pandas
+from app.graph.llm import chat_text, strict_json_schema, try_embed
+from app.graph.llm_cache import cached_chat_json, cached_chat_structured, cached_chat_text, peek_chat_json
 from app.graph.prompts import (
     CODEGEN_PROMPT,
     COLUMN_INFERENCE_PROMPT,
     CONFIRMATION_INTERPRETER_PROMPT,
-    REPAIR_PROMPT,
+    REPAIR_JSON_PROMPT,
     SUPERVISOR_PLAN_PROMPT,
 )
-from app.graph.state import AgentState, ColumnConfig
+from app.graph.semantic_cache import PREVIEW_CACHE
+from app.graph.state import AgentState, ColumnConfig, ConfirmationResult, RepairResult
 
 
 def _format_preview_for_llm(state: AgentState) -> str:
-    prev = state["df_preview"]
-    return f"""DATASET PREVIEW (top 5 rows):
-{prev["head"]}
+    # Precomputed by the dataset store at upload; if the state lacks it, build it once and keep it
+    # on the (persisted) state so later nodes and turns reuse it.
+    preview_str = state.get("df_preview_str")
+    if not preview_str:
+        preview_str = format_preview_for_llm(state["df_preview"])
+        state["df_preview_str"] = preview_str
+    return preview_str
+
+
+_YES = frozenset({"yes", "y", "sure", "yeah", "yep"})
+_NO = frozenset({"no", "n", "nope"})
+_CONFIRM = frozenset({"confirm", "confirmed", "go ahead", "proceed"})
+_FAST_ACTIONS = (
+    {tok: "yes" for tok in _YES}
+    | {tok: "no" for tok in _NO}
+    | {tok: "confirm" for tok in _CONFIRM}
+)
+
+_HORIZON_RE = re.compile(
+    r"(?:forecast\s*)?(?:for\s*)?(?:next\s*)?(\d+)\s*"
+    r"(day|days|d|week|weeks|w|month|months|m|year|years|y|quarter|quarters|qtr|qtrs|q)\b",
+    re.IGNORECASE,
+)
 
-COLUMN PROFILE:
-{prev["profile"]}
+# horizon unit -> (freq, periods per unit)
+_UNIT_MAP = {
+    "day": ("D", 1), "days": ("D", 1), "d": ("D", 1),
+    "week": ("W", 1), "weeks": ("W", 1), "w": ("W", 1),
+    "month": ("M", 1), "months": ("M", 1), "m": ("M", 1),
+    "year": ("M", 12), "years": ("M", 12), "y": ("M", 12),
+}
+# one quarter, by base freq
+_QUARTER_MAP = {"D": ("D", 90), "W": ("W", 13), "M": ("M", 3)}
 
-COLUMNS:
-{prev["columns"]}
-"""
+
+def _canonical_json(obj: Any) -> bytes:
+    # Deterministic (sorted-key) JSON for prompts and cache keys instead of Python repr
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
 
 
 def _normalize_config(raw: Dict[str, Any], fallback: Dict[str, Any]) -> ColumnConfig:
@@ -68,30 +112,67 @@ def _normalize_config(raw: Dict[str, Any], fallback: Dict[str, Any]) -> ColumnCo
     }
 
 
-def _render_config_block(cfg: Dict[str, Any], title: str = "Updated proposed configuration:") -> str:
-    regs = cfg.get("regressors", [])
-    return (
-        f"{title}\n"
-        f"- model: Prophet\n"
-        f"- ds: {cfg.get('ds_col','')}\n"
-        f"- y: {cfg.get('y_col','')}\n"
-        f"- regressors: {regs}\n"
-        f"- freq: {cfg.get('freq','D')}\n"
-        f"- periods: {cfg.get('periods',30)}\n"
-    )
+_UPDATED_HEADER = "Updated proposed configuration:"
+_CONFIRM_FOOTER = "Reply with 'confirm' to proceed, or specify further changes."
 
 
-def _final_ui_message(cfg: Dict[str, Any]) -> str:
-    return (
-        f"{_render_config_block(cfg)}\n"
-        "Reply with 'confirm' to proceed, or specify further changes."
+def _render_config(cfg: Dict[str, Any], header: str, footer: str = "") -> str:
+    lines = (
+        "- model: Prophet",
+        f"- ds: {cfg.get('ds_col','')}",
+        f"- y: {cfg.get('y_col','')}",
+        f"- regressors: {cfg.get('regressors', [])}",
+        f"- freq: {cfg.get('freq','D')}",
+        f"- periods: {cfg.get('periods',30)}",
     )
+    return f"{header}\n" + "\n".join(lines) + (f"\n\n{footer}" if footer else "")
 
 
 def _colnames(state: AgentState) -> List[str]:
-    prev = state.get("df_preview") or {}
-    cols = prev.get("columns") or []
-    return [str(c) for c in cols]
+    # Column names (and their lowercase lookup) are fixed per dataset: derive them from the
+    # preview once and keep them on the persisted state instead of rebuilding every turn.
+    cols = state.get("columns")
+    if cols is None:
+        prev = state.get("df_preview")
+        if not prev:
+            return []
+        cols = [str(c) for c in prev.get("columns") or []]
+        state["columns"] = cols
+    return cols
+
+
+def _colnames_lower(state: AgentState) -> Dict[str, str]:
+    cols_l = state.get("columns_lower")
+    if cols_l is None:
+        cols_l = {c.lower(): c for c in _colnames(state)}
+        if cols_l:
+            state["columns_lower"] = cols_l
+    return cols_l
+
+
+@functools.lru_cache(maxsize=64)
+def _column_regex(cols: Tuple[str, ...]) -> re.Pattern[str] | None:
+    # One alternation over all column names, compiled once per schema: a single scan of the
+    # message instead of one re.search per column. Longest names first so "temp_max" beats "temp".
+    # Empty names are dropped: an empty alternative would match at the first word boundary.
+    names = sorted({c.lower() for c in cols if c}, key=len, reverse=True)
+    if not names:
+        return None
+    return re.compile(r"\b(" + "|".join(map(re.escape, names)) + r")\b", re.IGNORECASE)
+
+
+# Phrases that REPLACE the regressor list; longer alternatives first so the slice after the
+# match starts at the list itself
+_REG_MARKER_RE = re.compile(r"regressors are|regressor is|is my regressor|as regressors|as regressor")
+# Candidate list separators: ",;/" and newlines map to "," in one translate; "and" is a word
+_REG_DELIM_TBL = str.maketrans({c: "," for c in ";/\n"})
+_AND_RE = re.compile(r"\band\b", re.IGNORECASE)
+# Trimmed from token ends only: "_", "." and "-" also occur inside column names
+_REG_TOKEN_STRIP = " .:-_()[]{}\"'"
+# "add" as a word: not "additionally", "address"...
+_ADD_WORD_RE = re.compile(r"\badd\b")
+_REG_IS_RE = re.compile(r"\bregressor\s+is\s+([a-zA-Z0-9_.]+)\b")
+_IS_MY_REG_RE = re.compile(r"\b([a-zA-Z0-9_.]+)\s+is\s+my\s+regressor\b")
 
 
 def _parse_regressor_override(user_msg: str, state: AgentState) -> Dict[str, Any] | None:
@@ -114,21 +195,11 @@ def _parse_regressor_override(user_msg: str, state: AgentState) -> Dict[str, Any
     msg_l = msg.lower()
 
     # Replacement triggers
-    replace_intent = any(
-        k in msg_l
-        for k in [
-            "regressors are",
-            "regressor is",
-            "is my regressor",
-            "as regressor",
-            "as regressors",
-        ]
-    )
-    if not replace_intent:
+    marker = _REG_MARKER_RE.search(msg_l)
+    if marker is None:
         return None
 
-    cols = _colnames(state)
-    cols_l = {c.lower(): c for c in cols}
+    cols_l = _colnames_lower(state)
 
     # Avoid using ds/y as regressors
     proposed = state.get("proposed_config") or {}
@@ -137,21 +208,14 @@ def _parse_regressor_override(user_msg: str, state: AgentState) -> Dict[str, Any
     blocked = {ds_col, y_col, ds_col.lower(), y_col.lower()}
 
     # 1) Prefer parsing AFTER the regressor phrase
-    candidates_text = ""
-    for marker in ["regressors are", "regressor is", "is my regressor", "as regressors", "as regressor"]:
-        idx = msg_l.find(marker)
-        if idx != -1:
-            candidates_text = msg[idx + len(marker):].strip()
-            break
+    candidates_text = msg[marker.end():].strip()
 
     picked: List[str] = []
 
     if candidates_text:
         # Split candidates list
-        tokens = re.split(r"[,\n;/]+|\band\b", candidates_text, flags=re.IGNORECASE)
-        tokens = [t.strip(" .:-_()[]{}\"'") for t in tokens if t.strip()]
-        for t in tokens:
-            key = t.lower()
+        for t in _AND_RE.sub(",", candidates_text).translate(_REG_DELIM_TBL).split(","):
+            key = t.strip(_REG_TOKEN_STRIP).lower()
             if key in cols_l:
                 c = cols_l[key]
                 if c not in blocked and c.lower() not in blocked:
@@ -159,9 +223,7 @@ def _parse_regressor_override(user_msg: str, state: AgentState) -> Dict[str, Any
 
     # 2) If still nothing, use tight regex near the regressor phrase (NOT whole-message scan)
     if not picked:
-        m = re.search(r"\bregressor\s+is\s+([a-zA-Z0-9_.]+)\b", msg_l)
-        if not m:
-            m = re.search(r"\b([a-zA-Z0-9_.]+)\s+is\s+my\s+regressor\b", msg_l)
+        m = _REG_IS_RE.search(msg_l) or _IS_MY_REG_RE.search(msg_l)
         if m:
             token = m.group(1).strip().lower()
             if token in cols_l:
@@ -170,159 +232,300 @@ def _parse_regressor_override(user_msg: str, state: AgentState) -> Dict[str, Any
                     picked.append(c)
 
     # Deduplicate while preserving order
-    seen = set()
-    picked = [x for x in picked if not (x in seen or seen.add(x))]
+    picked = list(dict.fromkeys(picked))
 
     return {"regressors": picked}
 
 
 def _parse_add_regressor(user_msg: str, state: AgentState) -> Dict[str, Any] | None:
     msg_l = (user_msg or "").lower()
-    if "add" not in msg_l or "regressor" not in msg_l:
+    if "regressor" not in msg_l or not _ADD_WORD_RE.search(msg_l):
         return None
 
     cols = _colnames(state)
-    cols_l = {c.lower(): c for c in cols}
+    if not cols:
+        return None
+    cols_l = _colnames_lower(state)
 
-    # pick first column mentioned after "add"
-    for c in cols:
-        if re.search(rf"\b{re.escape(c.lower())}\b", msg_l):
-            return {"add_regressor": cols_l.get(c.lower(), c)}
+    # pick the first column mentioned in the message
+    pattern = _column_regex(tuple(cols))
+    m = pattern.search(msg_l) if pattern is not None else None
+    if m:
+        return {"add_regressor": cols_l[m.group(1).lower()]}
     return None
 
 
+def _norm_msg(msg: str) -> str:
+    return (msg or "").strip().lower()
+
+
+ConfirmationIntent = Literal["confirm", "deny", "horizon", "regressor_replace", "regressor_add", "unknown"]
+
+
+def classify_confirmation_intent(msg: str) -> ConfirmationIntent:
+    """
+    Cheap, message-only triage for user_confirmation_node (same spirit as qa.is_probably_qa).
+    Each intent but "unknown" routes to a deterministic parser; a regressor reply that parser
+    cannot resolve is treated as "unknown" (local rules, then the LLM).
+    """
+    msg_norm = _norm_msg(msg)
+    action = _FAST_ACTIONS.get(msg_norm)
+    if action is not None:
+        return "deny" if action == "no" else "confirm"
+    if _HORIZON_RE.search(msg_norm):
+        return "horizon"
+    if _REG_MARKER_RE.search(msg_norm):
+        return "regressor_replace"
+    if "regressor" in msg_norm and _ADD_WORD_RE.search(msg_norm):
+        return "regressor_add"
+    return "unknown"
+
+
+# Local rules for the common "modify" replies, tried before the LLM interpreter.
+# Each clause names one column; several clauses may be chained ("use date as ds and sales as y").
+_COL_TOKEN = r"[\"'`]?([\w.]+)[\"'`]?"
+_SET_ROLE_RE = re.compile(
+    rf"(?:\b(?:use|set|make)\s+)?{_COL_TOKEN}\s+(?:as|for)\s+(?:the\s+)?(ds|y|date|time|timestamp|target)\b",
+    re.IGNORECASE,
+)
+_ADD_REG_RE = re.compile(
+    rf"\b(?:add|include)\s+{_COL_TOKEN}\s+(?:as\s+)?(?:an?\s+)?(?:extra\s+|additional\s+)?regressors?\b",
+    re.IGNORECASE,
+)
+_DROP_REG_RE = re.compile(
+    rf"\b(?:drop|remove|exclude)\s+(?:the\s+)?(?:regressor\s+)?{_COL_TOKEN}(?:\s+(?:as\s+)?(?:an?\s+)?regressors?)?",
+    re.IGNORECASE,
+)
+# What may remain once every clause is consumed; anything else goes to the LLM
+_FILLER_RE = re.compile(r"[\s,;.!]+|\b(?:and|then|also|please|instead)\b", re.IGNORECASE)
+_ROLE_FIELD = {
+    "ds": "ds_col", "date": "ds_col", "time": "ds_col", "timestamp": "ds_col",
+    "y": "y_col", "target": "y_col",
+}
+
+
+def _resolve_column(token: str, cols_l: Dict[str, str]) -> str | None:
+    key = token.lower()
+    if key in cols_l:
+        return cols_l[key]
+    match = difflib.get_close_matches(key, list(cols_l), n=1, cutoff=0.8)
+    return cols_l[match[0]] if match else None
+
+
+def _try_local_interpret(msg: str, proposed: ColumnConfig, cols_l: Dict[str, str]) -> ColumnConfig | None:
+    """
+    Deterministic interpreter for "use X as ds|y", "add X as a regressor" and "drop X regressor".
+    Returns the updated config, or None when the message has anything it cannot account for
+    (unknown column, extra words), so the caller falls back to the LLM interpreter.
+    """
+    raw: Dict[str, Any] = {
+        "ds_col": proposed.get("ds_col", ""),
+        "y_col": proposed.get("y_col", ""),
+        "regressors": list(proposed.get("regressors") or []),
+    }
+    matched = False
+
+    for m in _SET_ROLE_RE.finditer(msg):
+        col = _resolve_column(m.group(1), cols_l)
+        if col is None:
+            return None
+        raw[_ROLE_FIELD[m.group(2).lower()]] = col
+        matched = True
+
+    for m in _ADD_REG_RE.finditer(msg):
+        col = _resolve_column(m.group(1), cols_l)
+        if col is None:
+            return None
+        if col not in raw["regressors"]:
+            raw["regressors"].append(col)
+        matched = True
+
+    for m in _DROP_REG_RE.finditer(msg):
+        col = _resolve_column(m.group(1), cols_l)
+        if col is None or col not in raw["regressors"]:
+            return None
+        raw["regressors"].remove(col)
+        matched = True
+
+    if not matched:
+        return None
+
+    residue = msg
+    for pattern in (_SET_ROLE_RE, _ADD_REG_RE, _DROP_REG_RE):
+        residue = pattern.sub("", residue)
+    if _FILLER_RE.sub("", residue):
+        return None
+
+    # ds/y can never double as regressors
+    raw["regressors"] = [r for r in raw["regressors"] if r not in (raw["ds_col"], raw["y_col"])]
+    return _normalize_config(raw, proposed)
+
+
 async def supervisor_preview_node(state: AgentState) -> AgentState:
-    if "df_preview" not in state:
+    # Normally both arrive precomputed from the dataset store; build whatever is missing once
+    if "df_preview" not in state and "df" in state:
         state["df_preview"] = preview_payload(state["df"])
+    _format_preview_for_llm(state)
+    _colnames_lower(state)
     return state
 
 
-async def plan_node(state: AgentState) -> AgentState:
-    # Keep the supervisor plan stored (optional), but do not show it in UI
-    user = _format_preview_for_llm(state)
-    plan_text = await chat_text(SUPERVISOR_PLAN_PROMPT, user)
-    state["plan_text"] = plan_text
-    state["assistant_message"] = ""  # keep UI clean
-    return state
+def _config_fits_columns(cfg: Dict[str, Any], cols: List[str]) -> bool:
+    """
+    A semantically similar preview may still come from a different schema: only reuse a cached
+    config whose ds/y/regressors all exist in this dataset.
+    """
+    available = set(cols)
+    needed = [cfg.get("ds_col"), cfg.get("y_col"), *(cfg.get("regressors") or [])]
+    return all(c in available for c in needed if c)
+
 
+def _preview_key_src(preview: Dict[str, Any]) -> str:
+    # Plan and column inference are decided by the schema and profile, not the sample rows:
+    # re-uploads of the same data (or a different slice of it) share their exact-cache entry.
+    key = {"columns": preview.get("columns"), "profile": preview.get("profile")}
+    return orjson.dumps(key, default=str, option=orjson.OPT_SORT_KEYS).decode()
 
-async def column_inference_node(state: AgentState) -> AgentState:
+
+def _cached_preview_config(emb: Any, cols: List[str]) -> ColumnConfig | None:
+    if emb is None:
+        return None
+    hit = PREVIEW_CACHE.search(emb)
+    if hit is not None and _config_fits_columns(hit, cols):
+        return hit
+    return None
+
+
+async def _infer_config(user: str, state: AgentState) -> ColumnConfig:
+    key_src = _preview_key_src(state["df_preview"])
+    j = peek_chat_json(COLUMN_INFERENCE_PROMPT, user, key_src)
+    if j is not None:
+        return _normalize_config(j, {})
+
+    # Near-duplicate previews (re-uploads, small schema edits) reuse the earlier column mapping.
+    # The inference call starts right away so a semantic miss never waits on the embedding;
+    # an embeddings failure only skips the shortcut.
+    llm_task = asyncio.create_task(cached_chat_json(COLUMN_INFERENCE_PROMPT, user, key_src))
+    emb = await try_embed(user)
+    proposed = _cached_preview_config(emb, _colnames(state))
+    if proposed is not None:
+        llm_task.cancel()
+        return proposed
+
+    proposed = _normalize_config(await llm_task or {}, {})
+    if emb is not None:
+        PREVIEW_CACHE.add(emb, proposed)
+    return proposed
+
+
+async def plan_and_infer_node(state: AgentState) -> AgentState:
     user = _format_preview_for_llm(state)
-    j = await chat_json(COLUMN_INFERENCE_PROMPT, user)
 
-    proposed: ColumnConfig = _normalize_config(j or {}, {})
+    # The supervisor plan and the column inference both depend only on the preview, so they run
+    # concurrently. Inference checks the exact cache, then races the embedding lookup against its
+    # own LLM call, so a semantic-cache miss costs no extra latency on either side.
+    # The plan is never taken from the cross-dataset semantic cache: it may quote this data.
+    plan_text, proposed = await asyncio.gather(
+        cached_chat_text(SUPERVISOR_PLAN_PROMPT, user),
+        _infer_config(user, state),
+    )
+
+    # Keep the supervisor plan stored (optional), but do not show it in UI
+    state["plan_text"] = plan_text
     state["proposed_config"] = proposed
 
-    state["assistant_message"] = _final_ui_message(proposed)
+    state["assistant_message"] = _render_config(proposed, _UPDATED_HEADER, _CONFIRM_FOOTER)
     return state
 
 
+_CONFIRMATION_SCHEMA = strict_json_schema(ConfirmationResult)
+
+
 async def user_confirmation_node(state: AgentState) -> AgentState:
     proposed = state.get("proposed_config") or {}
     user_msg = (state.get("user_message") or "").strip()
-    msg_norm = user_msg.lower().strip()
+    msg_norm = _norm_msg(user_msg)
 
     if not user_msg:
         state["assistant_message"] = "Please confirm the proposed ds/y/regressors, or specify changes."
         return state
 
-    yes_tokens = {"yes", "y", "sure", "yeah", "yep"}
-    no_tokens = {"no", "n", "nope"}
-    confirm_tokens = {"confirm", "confirmed", "go ahead", "proceed"}
+    # A pending clarification only survives until the next message
+    pending = state.pop("pending_config", None)
 
-    # 1) pending yes/no
-    pending = state.get("pending_config")
-    if pending:
-        if msg_norm in yes_tokens:
-            updated = _normalize_config(pending, proposed)
-            state["proposed_config"] = updated
-            state["confirmed_config"] = updated
-            state.pop("pending_config", None)
-            state["assistant_message"] = "Generating code and running the forecast now."
-            return state
+    intent = classify_confirmation_intent(user_msg)
 
-        if msg_norm in no_tokens:
-            state.pop("pending_config", None)
-            state["assistant_message"] = "Okay — please specify the exact update you want or reply 'confirm'."
-            return state
+    # 1) yes/no/confirm: one dict lookup, no regex and no LLM round trip
+    if intent == "deny":
+        state["assistant_message"] = "Okay — please specify the exact update you want or reply 'confirm'."
+        return state
 
-        state.pop("pending_config", None)
+    if intent == "confirm":
+        # "yes" accepts the pending clarification if any; otherwise yes/confirm accept the proposal
+        chosen = pending if (msg_norm in _YES and pending) else proposed
+        confirmed = _normalize_config(chosen, proposed)
+        state["proposed_config"] = confirmed
+        state["confirmed_config"] = confirmed
+        state["assistant_message"] = "Generating code and running the forecast now."
+        return state
 
     # 2) horizon heuristic
-    m = re.search(
-        r"(?:forecast\s*)?(?:for\s*)?(?:next\s*)?(\d+)\s*"
-        r"(day|days|d|week|weeks|w|month|months|m|year|years|y|quarter|quarters|qtr|qtrs|q)\b",
-        msg_norm,
-    )
-    if m:
+    if intent == "horizon":
+        m = _HORIZON_RE.search(user_msg)
         n = int(m.group(1))
-        unit = m.group(2)
-
-        base_freq = (proposed.get("freq") or "D").strip()
-        if base_freq not in ("D", "W", "M"):
-            base_freq = "D"        
-
-        if unit in ("day", "days", "d"):
-            freq, periods = "D", n
-        elif unit in ("week", "weeks", "w"):
-            freq, periods = "W", n
-        elif unit in ("month", "months", "m"):
-            freq, periods = "M", n
-        elif unit in ("year", "years", "y"):
-            freq, periods = "M", n * 12            
+        unit = m.group(2).lower()
+
+        if unit in _UNIT_MAP:
+            freq, mult = _UNIT_MAP[unit]
         else:
-            if base_freq == "D":
-                freq, periods = "D", n * 90
-            elif base_freq == "W":
-                freq, periods = "W", n * 13
-            else:
-                freq, periods = "M", n * 3
+            # quarters are expressed in the current base frequency
+            base_freq = (proposed.get("freq") or "D").strip()
+            freq, mult = _QUARTER_MAP.get(base_freq, _QUARTER_MAP["D"])
+        periods = n * mult
 
         updated = _normalize_config({"freq": freq, "periods": periods}, proposed)
         state["proposed_config"] = updated
-        state["assistant_message"] = _final_ui_message(updated)
+        state["assistant_message"] = _render_config(updated, _UPDATED_HEADER, _CONFIRM_FOOTER)
         return state
 
     # 3) deterministic regressor override (REPLACE)
-    reg_override = _parse_regressor_override(user_msg, state)
-    if reg_override is not None:
-        # If user explicitly said regressor but we couldn't map, ask a clean clarifying question
-        if not reg_override.get("regressors"):
-            cols = _colnames(state)
-            state["assistant_message"] = (
-                "I couldn't identify that regressor column in your dataset. "
-                f"Available columns are: {cols}\n"
-                "Please type the exact column name for the regressor."
-            )
+    if intent == "regressor_replace":
+        reg_override = _parse_regressor_override(user_msg, state) or {}
+        if reg_override.get("regressors"):
+            updated = _normalize_config(reg_override, proposed)
+            state["proposed_config"] = updated
+            state["assistant_message"] = _render_config(updated, _UPDATED_HEADER, _CONFIRM_FOOTER)
             return state
-
-        updated = _normalize_config(reg_override, proposed)
-        state["proposed_config"] = updated
-        state["assistant_message"] = _final_ui_message(updated)
-        return state
+        # No column after the marker (e.g. "add price as regressor"): local rules, then the LLM
 
     # 4) deterministic add regressor (ADD)
-    add = _parse_add_regressor(user_msg, state)
-    if add:
-        updated_regs = list(proposed.get("regressors", []) or [])
-        r = add["add_regressor"]
-        if r not in updated_regs:
-            updated_regs.append(r)
-        updated = _normalize_config({"regressors": updated_regs}, proposed)
-        state["proposed_config"] = updated
-        state["assistant_message"] = _final_ui_message(updated)
-        return state
-
-    # 5) direct confirm
-    if msg_norm in confirm_tokens:
-        confirmed = _normalize_config(proposed, proposed)
-        state["confirmed_config"] = confirmed
-        state["assistant_message"] = "Generating code and running the forecast now."
+    if intent == "regressor_add":
+        add = _parse_add_regressor(user_msg, state)
+        if add:
+            updated_regs = list(proposed.get("regressors", []) or [])
+            r = add["add_regressor"]
+            if r not in updated_regs:
+                updated_regs.append(r)
+            updated = _normalize_config({"regressors": updated_regs}, proposed)
+            state["proposed_config"] = updated
+            state["assistant_message"] = _render_config(updated, _UPDATED_HEADER, _CONFIRM_FOOTER)
+            return state
+        # No exact column (near-miss name, "don't add any regressor"...): local rules, then the LLM
+
+    # 5) unknown intent, or a regressor reply the parsers above could not resolve:
+    #    common "use X as ds/y", "add/drop X regressor" edits (fuzzy names) still skip the LLM
+    local = _try_local_interpret(user_msg, proposed, _colnames_lower(state))
+    if local is not None:
+        state["proposed_config"] = local
+        state["assistant_message"] = _render_config(local, _UPDATED_HEADER, _CONFIRM_FOOTER)
         return state
 
     # 6) interpret via LLM (modify / ask_clarifying)
-    user = f"""proposed_config = {proposed}\n\nuser_message = {user_msg}"""
-    j = await chat_json(CONFIRMATION_INTERPRETER_PROMPT, user)
+    # Compact sorted-key JSON: proposed_config (stable) sorts ahead of user_message (volatile)
+    user = _canonical_json({"proposed_config": proposed, "user_message": user_msg}).decode()
+    j = await cached_chat_structured(
+        CONFIRMATION_INTERPRETER_PROMPT, user, "confirmation_result", _CONFIRMATION_SCHEMA
+    )
 
     action = (j.get("action") or "").lower().strip()
     msg_to_user = (j.get("message_to_user") or "").strip()
@@ -334,17 +537,9 @@ async def user_confirmation_node(state: AgentState) -> AgentState:
         return state
 
     if action == "modify":
-        raw_cfg = j.get("config") or {}
-
-        # IMPORTANT: If user text said "X is my regressor" but LLM returned many,
-        # override with deterministic parser (replace semantics).
-        reg_override2 = _parse_regressor_override(user_msg, state)
-        if reg_override2 is not None and reg_override2.get("regressors"):
-            raw_cfg["regressors"] = reg_override2["regressors"]
-
-        updated = _normalize_config(raw_cfg, proposed)
+        updated = _normalize_config(j.get("config") or {}, proposed)
         state["proposed_config"] = updated
-        state["assistant_message"] = _final_ui_message(updated)
+        state["assistant_message"] = _render_config(updated, _UPDATED_HEADER, _CONFIRM_FOOTER)
         return state
 
     if action == "ask_clarifying":
@@ -358,55 +553,253 @@ async def user_confirmation_node(state: AgentState) -> AgentState:
     return state
 
 
+_CODEGEN_KEY_FIELDS = ("model", "ds_col", "y_col", "regressors", "freq", "periods")
+
+
+@functools.lru_cache(maxsize=1)
+def _codegen_cache() -> Cache:
+    return Cache(CODEGEN_CACHE_DIR)
+
+
+def _codegen_key(config: ColumnConfig) -> str:
+    # Codegen depends only on the normalized config (not the preview) and on the prompt itself
+    payload = {k: config.get(k) for k in _CODEGEN_KEY_FIELDS}
+    payload["prompt"] = hashlib.sha256(CODEGEN_PROMPT.encode("utf-8")).hexdigest()
+    return hashlib.sha256(_canonical_json(payload)).hexdigest()
+
+
+def _forget_codegen(config: ColumnConfig, code: str) -> None:
+    # Drop the cached code for this config if it is the version that just failed
+    cache = _codegen_cache()
+    key = _codegen_key(config)
+    if cache.get(key) == code:
+        cache.delete(key)
+
+
 async def codegen_node(state: AgentState) -> AgentState:
     config = state.get("confirmed_config")
     if not config:
         return state
 
-    user = f"confirmed_config = {config}"
+    key = _codegen_key(config)
+    cached = _codegen_cache().get(key)
+    if cached is not None:
+        state["generated_code"] = cached
+        return state
+
+    user = f"confirmed_config = {_canonical_json(config).decode()}"
+    # Not the exact-response cache: after a failed run the config must get a fresh generation.
+    # Code is only persisted (by exec_node) once it has actually run successfully.
     code = await chat_text(CODEGEN_PROMPT, user)
     state["generated_code"] = code
     print(code)
     return state
 
 
-def _safe_exec_run(code: str, df: pd.DataFrame, config: Dict[str, Any]) -> Dict[str, Any]:
-    allowed_globals: Dict[str, Any] = {
-        "__builtins__": {
-            "__import__": __import__,
-            "Exception": Exception,
-            "ValueError": ValueError,
-            "TypeError": TypeError,
-            "len": len,
-            "range": range,
-            "min": min,
-            "max": max,
-            "sum": sum,
-            "abs": abs,
-            "float": float,
-            "int": int,
-            "str": str,
-            "bool": bool,
-            "list": list,
-            "dict": dict,
-            "set": set,
-            "tuple": tuple,
-            "enumerate": enumerate,
-            "zip": zip,
-            "print": print,
-        },
+# Resolved run(df, config) callables keyed by code digest (bounded LRU, per worker process).
+# Repeat runs and retries of identical code skip parse, compile and module exec entirely.
+_CODE_CACHE_MAX = 64
+_CODE_CACHE: "OrderedDict[str, Callable[..., Dict[str, Any]]]" = OrderedDict()
+
+
+@functools.lru_cache(maxsize=1)
+def _fast_prophet() -> type:
+    """
+    Import prophet (and its Stan backend) on first forecast, not when this module loads:
+    the import takes seconds and most imports of this module (API workers, spawn-started
+    exec workers before their first job) never fit a model.
+    """
+    from prophet import Prophet
+
+    class FastProphet(Prophet):
+        """
+        Prophet with sampling-free defaults for generated code: uncertainty_samples=0 skips the
+        O(n * samples) posterior simulation in predict(), and yhat_lower/yhat_upper are filled
+        analytically from the fitted observation noise (yhat +/- z * sigma_obs) so the output
+        columns are unchanged. Explicit kwargs from the caller still win.
+        """
+
+        def __init__(self, *args: Any, **kwargs: Any) -> None:
+            kwargs.setdefault("uncertainty_samples", 0)
+            kwargs.setdefault("mcmc_samples", 0)
+            super().__init__(*args, **kwargs)
+
+        def predict(self, *args: Any, **kwargs: Any) -> pd.DataFrame:
+            fcst = super().predict(*args, **kwargs)
+            if "yhat" in fcst.columns and "yhat_lower" not in fcst.columns:
+                sigma = float(np.mean(self.params["sigma_obs"])) * float(self.y_scale)
+                z = NormalDist().inv_cdf(0.5 + self.interval_width / 2.0)
+                fcst["yhat_lower"] = fcst["yhat"] - z * sigma
+                fcst["yhat_upper"] = fcst["yhat"] + z * sigma
+            return fcst
+
+    return FastProphet
+
+
+def to_prophet_df(df: pd.DataFrame, ds_col: str, y_col: str) -> pd.DataFrame:
+    """
+    ds/y frame for Prophet: ds parsed with a per-value cache, y coerced to numeric. y stays
+    float64: Prophet scales it in float64 anyway, and float32 would round large targets.
+    """
+    return pd.DataFrame({
+        "ds": pd.to_datetime(df[ds_col], errors="coerce", cache=True),
+        "y": pd.to_numeric(df[y_col], errors="coerce").astype("float64"),
+    })
+
+
+# Fitted models keyed by (training frame digest, fit settings), per worker process. A repair
+# retry or re-run whose code builds the same dfp with the same settings skips the Stan fit.
+_MODEL_CACHE_MAX = 8
+_MODEL_CACHE: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+
+
+def _frame_digest(obj: Union[pd.DataFrame, pd.Series]) -> str:
+    rows = pd.util.hash_pandas_object(obj, index=False).to_numpy()
+    h = hashlib.blake2b(rows.tobytes(), digest_size=16)
+    if isinstance(obj, pd.DataFrame):
+        h.update(repr((tuple(map(str, obj.columns)), tuple(map(str, obj.dtypes)))).encode("utf-8"))
+    else:
+        h.update(repr((str(obj.name), str(obj.dtype))).encode("utf-8"))
+    return h.hexdigest()
+
+
+def fit_prophet(dfp: pd.DataFrame, regressors: Any = (), **kwargs: Any) -> Any:
+    """
+    Prophet(**kwargs) with the given regressors, fitted on dfp, or the model already fitted on
+    an identical frame with identical settings. Callers must treat the model as read-only.
+    """
+    regs = tuple(str(r) for r in (regressors or ()))
+    # Frame-valued settings (holidays=...) have truncated reprs: key them by content instead
+    settings = sorted((k, _frame_digest(v) if isinstance(v, (pd.DataFrame, pd.Series)) else v)
+                      for k, v in kwargs.items())
+    key = (_frame_digest(dfp), repr((regs, settings)))
+
+    model = _MODEL_CACHE.get(key)
+    if model is not None:
+        _MODEL_CACHE.move_to_end(key)
+        return model
+
+    model = _fast_prophet()(**kwargs)
+    for reg in regs:
+        model.add_regressor(reg)
+    model.fit(dfp)
+
+    _MODEL_CACHE[key] = model
+    while len(_MODEL_CACHE) > _MODEL_CACHE_MAX:
+        _MODEL_CACHE.popitem(last=False)
+    return model
+
+
+def extend_regressor(values: Any, length: int) -> np.ndarray:
+    """
+    Regressor column for a make_future_dataframe frame: the known history followed by the last
+    non-missing value, built in one float32 allocation (no per-row loop, no concat).
+    """
+    known = np.asarray(values, dtype=np.float32)
+    out = np.empty(length, dtype=np.float32)
+    n = min(known.size, length)
+    out[:n] = known[:n]
+    finite = known[~np.isnan(known)]
+    out[n:] = finite[-1] if finite.size else np.nan
+    return out
+
+
+# Sandbox namespace for generated code, built once on first exec; each exec gets a shallow copy.
+_BUILTINS: Dict[str, Any] = {
+    "__import__": __import__,
+    "Exception": Exception,
+    "ValueError": ValueError,
+    "TypeError": TypeError,
+    "len": len,
+    "range": range,
+    "min": min,
+    "max": max,
+    "sum": sum,
+    "abs": abs,
+    "float": float,
+    "int": int,
+    "str": str,
+    "bool": bool,
+    "list": list,
+    "dict": dict,
+    "set": set,
+    "tuple": tuple,
+    "enumerate": enumerate,
+    "zip": zip,
+    "print": print,
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _exec_globals_base() -> Dict[str, Any]:
+    return {
+        "__builtins__": _BUILTINS,
         "pd": pd,
         "np": np,
-        "Prophet": Prophet,
+        "Prophet": _fast_prophet(),
+        "to_prophet_df": to_prophet_df,
+        "extend_regressor": extend_regressor,
+        "fit_prophet": fit_prophet,
     }
+
+
+_RUN_MISSING_MSG = "Generated code did not define a callable function named `run(df, config)`."
+
+
+def code_digest(code: str) -> str:
+    return hashlib.blake2b(code.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _load_run(code: str) -> Callable[..., Dict[str, Any]]:
+    h = code_digest(code)
+    run_fn = _CODE_CACHE.get(h)
+    if run_fn is not None:
+        _CODE_CACHE.move_to_end(h)
+        return run_fn
+
+    allowed_globals = _exec_globals_base().copy()
     local_vars: Dict[str, Any] = {}
-    exec(code, allowed_globals, local_vars)
+    exec(compile(code, f"<codegen:{h}>", "exec"), allowed_globals, local_vars)
 
     run_fn = local_vars.get("run") or allowed_globals.get("run")
     if not callable(run_fn):
-        raise ValueError("Generated code did not define a callable function named `run(df, config)`.")
+        raise ValueError(_RUN_MISSING_MSG)
+
+    _CODE_CACHE[h] = run_fn
+    while len(_CODE_CACHE) > _CODE_CACHE_MAX:
+        _CODE_CACHE.popitem(last=False)
+    return run_fn
+
+
+def _unproxy(obj: Any) -> Any:
+    if isinstance(obj, (dict, MappingProxyType)):
+        return {k: _unproxy(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_unproxy(v) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(_unproxy(v) for v in obj)
+    return obj
+
+
+def _safe_exec_run(code: str, data: Union[str, pd.DataFrame], config: Dict[str, Any]) -> Dict[str, Any]:
+    # `data` is normally the dataset's Feather path: the worker memory-maps the Arrow file
+    # instead of receiving the whole DataFrame pickled through the pool's pipe.
+    if isinstance(data, str):
+        df = arrow_to_pandas(feather.read_table(data, memory_map=True))
+    else:
+        df = data
+    # Generated code gets a read-only view (a mutation raises TypeError and goes to repair).
+    # The proxy is made here, in the worker: it cannot be pickled across the pool boundary.
+    out = _load_run(code)(df, MappingProxyType(config))
+    # The result may hand `config` back anywhere (config_used, nested...): unwrap every proxy
+    return _unproxy(out)
 
-    return run_fn(df, config)
+
+@functools.lru_cache(maxsize=1)
+def _exec_pool() -> ProcessPoolExecutor:
+    # Created on first forecast. "spawn" avoids forking a process that already runs
+    # event-loop and threadpool threads.
+    return ProcessPoolExecutor(max_workers=EXEC_WORKERS, mp_context=multiprocessing.get_context("spawn"))
 
 
 async def exec_node(state: AgentState) -> AgentState:
@@ -417,11 +810,21 @@ async def exec_node(state: AgentState) -> AgentState:
         return state
 
     try:
-        out = _safe_exec_run(code, state["df"], dict(config))
+        # Prophet fitting is CPU-bound: run it in a worker process so the event loop stays
+        # responsive and concurrent forecasts use separate cores.
+        loop = asyncio.get_running_loop()
+        data = state.get("dataset_path") or state["df"]
+        out = await loop.run_in_executor(_exec_pool(), _safe_exec_run, code, data, config)
         state["exec_output"] = out
         state["exec_error"] = None
         state["traceback"] = None
+        # The code that actually ran (possibly a repaired version) becomes this config's codegen
+        _codegen_cache().set(_codegen_key(config), code)
     except Exception as e:
+        if isinstance(e, BrokenProcessPool):
+            # A worker died (e.g. crashed inside Stan); start a fresh pool next time
+            _exec_pool.cache_clear()
+        _forget_codegen(config, code)
         state["exec_output"] = None
         state["exec_error"] = f"{type(e).__name__}: {e}"
         state["traceback"] = tb.format_exc()
@@ -429,13 +832,7 @@ async def exec_node(state: AgentState) -> AgentState:
     return state
 
 
-async def traceback_node(state: AgentState) -> AgentState:
-    if state.get("exec_error"):
-        state["assistant_message"] = (
-            "I hit an execution error while running the generated Prophet code. "
-            "I’m regenerating a corrected version and retrying."
-        )
-    return state
+_REPAIR_SCHEMA = strict_json_schema(RepairResult)
 
 
 async def repair_codegen_node(state: AgentState) -> AgentState:
@@ -450,7 +847,31 @@ async def repair_codegen_node(state: AgentState) -> AgentState:
     failing_code = state.get("generated_code") or ""
     trace = state.get("traceback") or state.get("exec_error") or ""
     user = f"FAILING CODE:\n{failing_code}\n\nTRACEBACK:\n{trace}"
-    repaired = await chat_text(REPAIR_PROMPT, user)
+    # Diagnosis and fix in one round trip (this used to be a separate traceback hop + a text call)
+    try:
+        j = await cached_chat_structured(REPAIR_JSON_PROMPT, user, "repair_result", _REPAIR_SCHEMA)
+    except ValueError:
+        j = {}
+    if not isinstance(j, dict):
+        j = {}
+    code = j.get("code")
+    # No usable code counts as repeating the failing version, which ends the loop below
+    repaired = code if isinstance(code, str) and code.strip() else failing_code
+    state["assistant_message"] = j.get("diagnosis") or (
+        "I hit an execution error while running the generated Prophet code. "
+        "I’m regenerating a corrected version and retrying."
+    )
+
+    # Every version already executed this turn; a repair that reproduces one of them
+    # (byte-identical, or cycling back after >2 attempts) is guaranteed to fail again.
+    prior = state.setdefault("prior_code_hashes", [])
+    old_h = code_digest(failing_code)
+    if old_h not in prior:
+        prior.append(old_h)
+    if code_digest(repaired) in prior:
+        # Keep the failing code so the router sends us straight to results (no exec, no refit)
+        state["attempt"] = max_attempts
+        return state
 
     state["generated_code"] = repaired
     state["attempt"] = attempt + 1
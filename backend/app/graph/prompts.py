@@ -40,9 +40,9 @@ If you cannot determine ds/y confidently, set ds_col or y_col to "" and explain
 
 CONFIRMATION_INTERPRETER_PROMPT = """You are a configuration confirmer.
 
-Inputs:
-1) proposed_config JSON
-2) user_message (natural language)
+Input: one JSON object with
+1) proposed_config: the current configuration
+2) user_message: the user's reply (natural language)
 
 Your job:
 - If the user confirms (e.g., "yes", "confirm", "looks good"), output action="confirm" and keep config.
@@ -65,7 +65,17 @@ def run(df: pd.DataFrame, config: dict) -> dict:
 
 Requirements:
 - Use only: pandas as pd, numpy as np, Prophet from prophet
+- pd, np and Prophet are already provided in the namespace; do NOT import prophet yourself
+  (the provided Prophet skips posterior sampling and still returns yhat_lower/yhat_upper)
+- A helper to_prophet_df(df, ds_col, y_col) is provided: it returns a DataFrame with ds
+  (datetime, errors coerced) and y (float64, errors coerced)
+- A helper extend_regressor(values, length) is provided: it returns a float32 array with the
+  given history values followed by their last non-missing value, padded out to length
+- A helper fit_prophet(dfp, regressors=[...], **prophet_kwargs) is provided: it creates the
+  (provided) Prophet with prophet_kwargs, adds the regressors, fits on dfp and returns the model.
+  A model already fitted on identical data and settings is reused instead of refitted
 - Read config keys: ds_col, y_col, regressors (list), freq, periods
+- config is a read-only mapping: never assign to it or mutate its values; copy what you need
 - Create dfp with columns renamed to ds and y from config
 - Parse ds to datetime with errors='coerce'
 - Convert y to numeric with errors='coerce'
@@ -78,18 +88,28 @@ Requirements:
     - Carry reg into dfp (same name)
     - Convert to numeric if possible; if conversion fails, attempt simple category encoding using pandas factorize
     - Fill missing with median (numeric) or -1 (encoded)
-    - model.add_regressor(reg)
+    - Cast the finished column ONCE with .astype(np.float32, copy=False)
 
-- Fit Prophet
+- Fit with model = fit_prophet(dfp, regressors=regressors, uncertainty_samples=0, mcmc_samples=0)
+  (never call model.fit or add_regressor yourself; the returned model may be shared, so only
+  call make_future_dataframe/predict on it)
+  - Do NOT call predictive_samples or compute intervals by sampling: the provided Prophet fills
+    yhat_lower/yhat_upper analytically (yhat +/- z * sigma_obs) over the whole horizon
 - Create future dataframe with make_future_dataframe(periods=periods, freq=freq)
 
 - If regressors present, extend regressors into future:
   - For each reg in regressors:
-    - last_known = dfp[reg].ffill().iloc[-1]
-    - Create the column in future: future[reg] = last_known
+    - future[reg] = extend_regressor(dfp[reg].to_numpy(), len(future))
 
 - Predict
 
+DTYPES / PERFORMANCE:
+- Keep y float64 (to_prophet_df already does; never downcast y: float32 keeps only ~7 significant
+  digits). Regressors may be float32
+- Convert each column once, whole-column; never call .astype() or pd.to_numeric per row or inside a row loop
+- Assemble dfp from columns in one step (a dict passed to pd.DataFrame, or .assign); do not grow it
+  with repeated pd.concat or row appends
+
 CRITICAL OUTPUT REQUIREMENTS (for UI friendliness):
 - Return ONLY FUTURE forecasts (do NOT return fitted historical rows).
 - Rename columns so they match the user's chosen ds/y names:
@@ -101,23 +121,32 @@ CRITICAL OUTPUT REQUIREMENTS (for UI friendliness):
 
 - Return a dict with:
   - "forecast": list of records for ONLY future rows with renamed columns
-  - "config_used": config
+  - "config_used": dict(config)
   - "training_rows": number
   - "input_rows": number
 
 Be defensive and raise ValueError with clear messages if ds_col/y_col missing or training data ends up empty.
 """
 
-REPAIR_PROMPT = """You are debugging generated Prophet code.
+REPAIR_JSON_PROMPT = """You are debugging generated Prophet code.
 
 You will be given:
 - the failing code
 - the traceback/error
 
-Produce a corrected version of the entire code.
-Rules:
-- Output ONLY Python code (no markdown)
-- Keep the required run(df, config) signature
+Diagnose the failure and produce a corrected version of the entire code.
+Return STRICT JSON only:
+{
+  "diagnosis": "one or two sentences for the user: what went wrong and what you changed",
+  "code": "the full corrected Python code as a single JSON string"
+}
+
+Rules for "code":
+- Plain Python only (no markdown fences inside the string)
+- Keep the required run(df, config) signature; config is read-only, so do not mutate it
+- pd, np, Prophet, to_prophet_df(df, ds_col, y_col), extend_regressor(values, length) and
+  fit_prophet(dfp, regressors=[...], **prophet_kwargs) are already provided; do NOT import prophet.
+  If the error comes from building the ds/y columns, use to_prophet_df instead of manual parsing
 - Fix the error robustly without removing core functionality
 """
 
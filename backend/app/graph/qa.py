@@ -1,10 +1,16 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import re
 from typing import Any, Dict, Tuple
 
-from app.graph.llm import chat_text
+import orjson
+
+from app.graph.llm import try_embed
+from app.graph.llm_cache import cached_chat_text
 from app.graph.prompts import FORECAST_QA_PROMPT
+from app.graph.semantic_cache import QA_CACHE
 from app.graph.state import AgentState
 
 
@@ -21,6 +27,20 @@ _QA_STARTERS = (
     "explain", "meaning", "interpret", "suggest", "recommend"
 )
 
+# Direct instructions that mention regressors/ds/y ("regressor is T", "use date as ds")
+_INSTRUCTION_RE = re.compile(
+    r"\bregressors?\s+(?:are|is)\s+\w+"
+    r"|\badd\s+regressors?\b"
+    r"|\b(?:use|set)\s+\w+\s+as\s+(?:ds|y)\b"
+)
+
+
+# Questions about the raw data itself; only these get the sample head rows in the QA context
+_DATA_SHAPE_RE = re.compile(
+    r"\b(?:rows?|head|records?|samples?|values?|examples?|shape|raw data|looks? like)\b"
+)
+
+
 def _norm(s: str) -> str:
     return (s or "").strip().lower()
 
@@ -43,13 +63,7 @@ def is_probably_qa(user_message: str) -> bool:
     # Modification messages are tricky because they include "regressor".
     # If it's clearly an instruction ("regressor is T", "add regressor X"), treat as non-QA.
     # Otherwise, Q about regressors ("what regressors are meaningful") should be QA.
-    instruction_patterns = [
-        r"\bregressors?\s+(are|is)\s+\w+",
-        r"\badd\s+regressors?\b",
-        r"\buse\s+\w+\s+as\s+(ds|y)\b",
-        r"\bset\s+\w+\s+as\s+(ds|y)\b",
-    ]
-    if any(re.search(p, m) for p in instruction_patterns):
+    if _INSTRUCTION_RE.search(m):
         return False
 
     # Positive signals
@@ -94,12 +108,17 @@ def _summarize_results(exec_output: Any) -> Dict[str, Any]:
     }
 
 
-def build_qa_context(state: AgentState) -> Dict[str, Any]:
+def build_qa_context(state: AgentState, include_head: bool = True) -> Dict[str, Any]:
     """
     Build a single structured context object for Q&A.
+    include_head=False leaves the sample rows out of the dataset preview (profile and columns stay).
     """
+    preview = state.get("df_preview")
+    if preview and not include_head:
+        preview = {k: v for k, v in preview.items() if k != "head"}
+
     ctx: Dict[str, Any] = {
-        "dataset_preview": state.get("df_preview"),
+        "dataset_preview": preview,
         "plan_text": state.get("plan_text"),
         "proposed_config": state.get("proposed_config"),
         "confirmed_config": state.get("confirmed_config"),
@@ -109,6 +128,16 @@ def build_qa_context(state: AgentState) -> Dict[str, Any]:
     return ctx
 
 
+def _render_qa_context(state: AgentState, question: str) -> Tuple[str, str]:
+    """
+    Build the context, render it as compact JSON for the prompt and digest it (the QA cache scope).
+    """
+    ctx = build_qa_context(state, include_head=bool(_DATA_SHAPE_RE.search(_norm(question))))
+    # Compact, sorted-key JSON: far fewer tokens than the dict repr and stable for the digest
+    rendered = orjson.dumps(ctx, default=str, option=orjson.OPT_SORT_KEYS)
+    return rendered.decode(), hashlib.sha256(rendered).hexdigest()
+
+
 # -----------------------------
 # Main QA entry point
 # -----------------------------
@@ -118,12 +147,32 @@ async def answer_forecast_qa(state: AgentState) -> str:
     Uses FORECAST_QA_PROMPT to answer user questions using available context.
     """
     user_message = state.get("user_message") or ""
-    ctx = build_qa_context(state)
 
-    user = f"""USER QUESTION:
-{user_message}
+    # The question embeds (for the semantic cache) while the context renders in a thread;
+    # an embeddings failure only disables the cache for this turn.
+    emb_task = asyncio.create_task(try_embed(user_message))
+    ctx_text, ctx_digest = await asyncio.to_thread(_render_qa_context, state, user_message)
+
+    # Context first, question last: follow-up questions on the same state then share the
+    # whole system + context prefix in the provider's prompt cache.
+    user = f"""CONTEXT (JSON):
+{ctx_text}
 
-CONTEXT (JSON-like):
-{ctx}
+USER QUESTION:
+{user_message}
 """
-    return await chat_text(FORECAST_QA_PROMPT, user)
+    # Start the answer right away so a cache miss never waits on the embedding round trip
+    answer_task = asyncio.create_task(cached_chat_text(FORECAST_QA_PROMPT, user))
+
+    # Rephrasings of a question already answered for this exact context reuse that answer
+    emb = await emb_task
+    if emb is not None:
+        hit = QA_CACHE.search(emb, scope=ctx_digest)
+        if hit is not None:
+            answer_task.cancel()
+            return hit
+
+    answer = await answer_task
+    if emb is not None:
+        QA_CACHE.add(emb, answer, scope=ctx_digest)
+    return answer
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import copy
+from dataclasses import dataclass, field
+from typing import Any, Hashable, List, Optional
+
+import numpy as np
+
+from app.core.config import QA_SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_THRESHOLD
+
+
+@dataclass
+class SemanticCache:
+    """
+    Embedding-similarity cache: a lookup hits when the best cosine similarity between the query
+    embedding and a stored key is >= threshold. Vectors must be L2-normalized (see llm.embed),
+    so the search is one exact inner-product matmul over a small bounded matrix.
+    Oldest entries are dropped once max_entries is reached.
+    An optional scope restricts a lookup to entries added with the same scope.
+    """
+    threshold: float = SEMANTIC_CACHE_THRESHOLD
+    max_entries: int = 1024
+    _vectors: Optional[np.ndarray] = None
+    _payloads: List[Any] = field(default_factory=list)
+    _scopes: List[Hashable] = field(default_factory=list)
+
+    def search(self, emb: np.ndarray, scope: Hashable = None) -> Optional[Any]:
+        if self._vectors is None or not self._payloads:
+            return None
+        scores = self._vectors @ emb
+        if scope is not None:
+            in_scope = np.fromiter((s == scope for s in self._scopes), dtype=bool, count=len(self._scopes))
+            if not in_scope.any():
+                return None
+            scores = np.where(in_scope, scores, -np.inf)
+        best = int(np.argmax(scores))
+        if float(scores[best]) < self.threshold:
+            return None
+        return copy.deepcopy(self._payloads[best])
+
+    def add(self, emb: np.ndarray, payload: Any, scope: Hashable = None) -> None:
+        row = emb.astype(np.float32, copy=False)[None, :]
+        if self._vectors is None:
+            self._vectors = row.copy()
+        else:
+            self._vectors = np.vstack((self._vectors, row))
+        self._payloads.append(copy.deepcopy(payload))
+        self._scopes.append(scope)
+
+        overflow = len(self._payloads) - self.max_entries
+        if overflow > 0:
+            self._vectors = self._vectors[overflow:]
+            del self._payloads[:overflow]
+            del self._scopes[:overflow]
+
+
+# First-turn proposed_config keyed by the dataset preview embedding. Shared across datasets,
+# so it holds only the column mapping (validated against the new schema), never plan text.
+PREVIEW_CACHE = SemanticCache()
+
+# Q&A answers keyed by the question embedding, scoped to a digest of the Q&A context
+QA_CACHE = SemanticCache(threshold=QA_SEMANTIC_CACHE_THRESHOLD)
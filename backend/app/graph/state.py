@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional, TypedDict
+from typing import Any, Dict, List, Literal, Optional, TypedDict
 
 import pandas as pd
+from pydantic import BaseModel
 
 
 class ColumnConfig(TypedDict, total=False):
@@ -14,6 +15,34 @@ class ColumnConfig(TypedDict, total=False):
     periods: int
 
 
+# Structured-output schemas. Strict mode makes every field required and rejects "default",
+# so these models declare none.
+class ConfirmationConfig(BaseModel):
+    ds_col: str
+    y_col: str
+    regressors: List[str]
+    freq: str
+    periods: int
+
+
+class ConfirmationResult(BaseModel):
+    """
+    Output schema of the CONFIRMATION_INTERPRETER call (sent as a json_schema response format).
+    """
+    action: Literal["confirm", "modify", "ask_clarifying"]
+    config: ConfirmationConfig
+    message_to_user: str
+
+
+class RepairResult(BaseModel):
+    """
+    Output schema of the REPAIR_JSON call: the program travels as a JSON string, so the
+    provider must do the escaping (newlines, regex backslashes) for it to parse.
+    """
+    diagnosis: str
+    code: str
+
+
 class AgentState(TypedDict, total=False):
     dataset_id: str
     user_message: str
@@ -22,6 +51,10 @@ class AgentState(TypedDict, total=False):
     # Data
     df: pd.DataFrame
     df_preview: Dict[str, Any]
+    df_preview_str: str      # df_preview rendered for LLM prompts (cached per dataset)
+    dataset_path: str        # Feather file backing df (handed to exec workers instead of df)
+    columns: List[str]               # df_preview["columns"] as str, derived once per dataset
+    columns_lower: Dict[str, str]    # lowercase name -> column name
 
     # Plan/config
     plan_text: str
@@ -41,6 +74,7 @@ class AgentState(TypedDict, total=False):
     # Retry controls
     attempt: int
     max_attempts: int
+    prior_code_hashes: List[str]   # digests of code already executed this turn
 
     # UI controls
     show_code: bool